@@ -10,6 +10,7 @@ ImageCaptioningInvoker接收包含图像路径的JSON输入，
 
 import os
 import base64
+import functools
 from typing import Dict, Any, Optional
 from jsonflow.operators.model import ModelInvoker
 from jsonflow.core import Pipeline
@@ -17,6 +18,17 @@ from jsonflow.io import JsonLoader, JsonSaver
 import argparse
 
 
+@functools.lru_cache(maxsize=128)
+def _encode_image(image_path: str, mtime_ns: int, size: int) -> str:
+    """
+    读取图像并编码为base64字符串
+
+    mtime_ns和size只参与缓存键，文件被修改后会重新编码。
+    """
+    with open(image_path, "rb") as image_file:
+        return base64.standard_b64encode(image_file.read()).decode('ascii')
+
+
 class ImageCaptioningInvoker(ModelInvoker):
     """图像标注操作符"""
     
@@ -59,8 +71,8 @@ class ImageCaptioningInvoker(ModelInvoker):
         
         # 读取并编码图像
         try:
-            with open(image_path, "rb") as image_file:
-                image_data = base64.b64encode(image_file.read()).decode('utf-8')
+            stat = os.stat(image_path)
+            image_data = _encode_image(image_path, stat.st_mtime_ns, stat.st_size)
         except Exception as e:
             result[self.caption_field] = f"图像读取错误: {str(e)}"
             return result
@@ -79,7 +91,6 @@ class ImageCaptioningInvoker(ModelInvoker):
         
         # 调用支持图像的模型
         try:
-            print(self.base_url)
             response = self.call_llm(messages)
             result[self.caption_field] = response
         except Exception as e:
@@ -107,8 +118,8 @@ def main():
     args = parser.parse_args()
     
     # 创建输出目录
-    output_dir = os.path.dirname(os.path.abspath(args.output))
-    if output_dir:
+    output_dir = os.path.dirname(args.output)
+    if output_dir and not os.path.isdir(output_dir):
         os.makedirs(output_dir, exist_ok=True)
     
     # 检查图像文件
@@ -5,8 +5,10 @@ This script reads raw JSONL input, maps fields, renders a prompt using a templat
 and outputs a final JSONL according to the final template mapping.
 """
 import os
+import re
 import sys
 import argparse
+import multiprocessing
 
 # Setup JSONFlow import path: add local build/lib if present
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -17,6 +19,11 @@ from jsonflow.core import Pipeline, JsonOperator
 from jsonflow.operators.json_ops import JsonFieldMapper
 from jsonflow.io import JsonLoader, JsonSaver
 
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib json used by JsonLoader/JsonSaver
+    orjson = None
+
 DEEP_MATH_MAPPING = {
     "question": "problem",
     "final_answer": "reference",
@@ -93,26 +100,37 @@ FINAL_JSON_TEMPLATE = {
     "max_output_tokens": "4096",
 }
 
+# records handed to each pool worker per task; the input length is unknown
+# up front since it is streamed
+IMAP_CHUNKSIZE = 64
+
 class PromptOperator(JsonOperator):  # noqa: D102
     """
     Operator to render a prompt template with provided fields.
     Replaces {{problem}}, {{reference}}, {{solution}} in the template.
+    The template is split into literal chunks once at construction time so
+    rendering is a single join instead of repeated full-template scans.
     """
+    PLACEHOLDER_RE = re.compile(r"\{\{(problem|reference|solution)\}\}")
+
     def __init__(self, template_str: str):
         super().__init__(name="PromptOperator", description="Render prompt template")
         self.template = template_str
+        # re.split with a capture group alternates literal, key, literal, ...
+        chunks = self.PLACEHOLDER_RE.split(template_str)
+        self._literals = chunks[0::2]
+        self._keys = chunks[1::2]
 
     def process(self, data: dict) -> dict:
-        result = data.copy()
-        # simple placeholder replacement
-        prompt = (
-            self.template
-            .replace("{{problem}}", str(data.get("problem", "")))
-            .replace("{{reference}}", str(data.get("reference", "")))
-            .replace("{{solution}}", str(data.get("solution", "")))
-        )
-        result["prompt"] = prompt
-        return result
+        # downstream operators only read the record, so render in place
+        parts = [self._literals[0]]
+        for key, literal in zip(self._keys, self._literals[1:]):
+            value = data.get(key, "")
+            # fields are almost always strings already; only convert the rest
+            parts.append(value if isinstance(value, str) else str(value))
+            parts.append(literal)
+        data["prompt"] = "".join(parts)
+        return data
 
 def build_field_mapper(deep_map: dict) -> JsonFieldMapper:
     """
@@ -128,52 +146,122 @@ class FinalMapper(JsonOperator):  # noqa: D102
     """
     Operator to map processed data to final JSON template.
     Uses mapping of output key -> source key or literal value.
+    Numeric literals are parsed once at construction time; every other
+    value is looked up in the record and falls back to the raw string.
     """
+    FIELD = "field"
+    LITERAL = "literal"
+
     def __init__(self, mapping: dict):
         super().__init__(name="FinalMapper", description="Final JSON mapping operator")
         self.mapping = mapping
+        self._plan = [self._resolve(out_key, val) for out_key, val in mapping.items()]
+
+    @classmethod
+    def _resolve(cls, out_key, val) -> tuple:
+        # attempt numeric literal
+        try:
+            if isinstance(val, str) and val.isdigit():
+                return (cls.LITERAL, out_key, int(val))
+            return (cls.LITERAL, out_key, float(val))
+        except (TypeError, ValueError):
+            return (cls.FIELD, out_key, val)
 
     def process(self, data: dict) -> dict:
         result = {}
-        for out_key, val in self.mapping.items():
-            # direct mapping from data if key exists
-            if val in data:
-                result[out_key] = data.get(val)
+        for kind, out_key, val in self._plan:
+            if kind == self.FIELD:
+                # direct mapping from data if key exists, else raw string
+                result[out_key] = data.get(val, val)
             else:
-                # attempt numeric literal
-                try:
-                    if isinstance(val, str) and val.isdigit():
-                        result[out_key] = int(val)
-                    else:
-                        result[out_key] = float(val)
-                except Exception:
-                    # fallback to raw string
-                    result[out_key] = val
+                result[out_key] = val
         return result
 
 
+class FastJsonLoader(JsonLoader):
+    """
+    JsonLoader that parses lines with orjson when it is installed.
+    Reads the file as bytes so no intermediate str is decoded per line.
+    """
+    def __iter__(self):
+        if orjson is None or self.source is None:
+            yield from super().__iter__()
+            return
+        with open(self.source, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield orjson.loads(line)
+
+
+class FastJsonSaver(JsonSaver):
+    """
+    JsonSaver that serializes with orjson when it is installed.
+    Within a ``with`` block the output is a 1MB-buffered binary file and each
+    record is written as orjson bytes with the trailing newline appended.
+    """
+    WRITE_BUFFER_SIZE = 1 << 20
+
+    def __enter__(self) -> "FastJsonSaver":
+        if orjson is None or self.destination is None:
+            return super().__enter__()
+        self._file = open(self.destination, 'wb', buffering=self.WRITE_BUFFER_SIZE)
+        return self
+
+    def write_item(self, json_data: dict) -> None:
+        if orjson is None or self._file is None:
+            super().write_item(json_data)
+            return
+        self._file.write(orjson.dumps(json_data, option=orjson.OPT_APPEND_NEWLINE))
+
+
+def build_pipeline() -> Pipeline:
+    """
+    Build the deepmath -> GRM prompt pipeline.
+    """
+    field_mapper = build_field_mapper(DEEP_MATH_MAPPING)
+    prompt_op     = PromptOperator(PROMPT_TEMPLATE)
+    final_op      = FinalMapper(FINAL_JSON_TEMPLATE)
+    return Pipeline([field_mapper, prompt_op, final_op])
+
+
+# per-process pipeline, built once by the pool initializer so the template
+# and mappings are not pickled along with every task
+_PIPELINE = None
+
+
+def _init_worker() -> None:
+    global _PIPELINE
+    _PIPELINE = build_pipeline()
+
+
+def _process_record(item: dict) -> dict:
+    return _PIPELINE.process(item)
+
+
 def main():  # noqa: C901
     parser = argparse.ArgumentParser(
         description="Process JSONL input using a JSONFlow pipeline."
     )
     parser.add_argument('-i', '--input',  required=True, help="Input JSONL file path")
     parser.add_argument('-o', '--output', required=True, help="Output JSONL file path")
+    parser.add_argument('-n', '--num-proc', type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (1 disables multiprocessing)")
     args = parser.parse_args()
 
-    field_mapper = build_field_mapper(DEEP_MATH_MAPPING)
-    prompt_op     = PromptOperator(PROMPT_TEMPLATE)
-    final_op      = FinalMapper(FINAL_JSON_TEMPLATE)
-
-    # create pipeline
-    pipeline = Pipeline([field_mapper, prompt_op, final_op])
+    # JsonLoader is iterable, so records are read lazily line by line
+    loader = FastJsonLoader(args.input)
 
-    # load input JSONL
-    loader = JsonLoader(args.input)
-    items = loader.load()
+    # process each item and stream results to output JSONL
+    with FastJsonSaver(args.output) as saver:
+        if args.num_proc > 1:
+            with multiprocessing.Pool(args.num_proc, initializer=_init_worker) as pool:
+                for result in pool.imap(_process_record, loader, chunksize=IMAP_CHUNKSIZE):
+                    saver.write(result)
+        else:
+            pipeline = build_pipeline()
+            for item in loader:
+                saver.write(pipeline.process(item))
 
-    # process each item
-    results = [pipeline.process(item) for item in items]
 
-    # save to output JSONL
-    saver = JsonSaver(args.output)
-    saver.write_all(results)
+if __name__ == "__main__":
+    main()
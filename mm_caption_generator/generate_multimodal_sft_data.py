@@ -22,20 +22,32 @@ import os
 import json
 import base64
 import re
-from pathlib import Path
 from typing import List, Dict, Any
 import argparse
 import io
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from PIL import Image
 
+try:
+    # orjson为C实现，解析速度明显快于标准库json
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 from jsonflow.core import Pipeline, JsonOperator
 from jsonflow.io import JsonLoader, JsonSaver
 from jsonflow.operators.json_ops import JsonTransformer, TextNormalizer
 from jsonflow.operators.model import MultimodalInvoker
 
+logger = logging.getLogger(__name__)
+
 # 支持的图片格式
 SUPPORTED_IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
 
+# 匹配不含嵌套花括号的JSON对象，线性时间，不会出现贪婪回溯
+_JSON_OBJECT_RE = re.compile(r'\{[^{}]*\}')
+
 def get_image_files(image_dir: str) -> List[str]:
     """
     获取目录下所有支持的图片文件
@@ -46,15 +58,15 @@ def get_image_files(image_dir: str) -> List[str]:
     Returns:
         图片文件路径列表
     """
+    # 只扫描一次目录，扩展名不区分大小写
+    extensions = {ext.lower() for ext in SUPPORTED_IMAGE_EXTENSIONS}
     image_files = []
-    for ext in SUPPORTED_IMAGE_EXTENSIONS:
-        image_files.extend(list(Path(image_dir).glob(f'*{ext}')))
+    with os.scandir(image_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in extensions:
+                image_files.append(entry.path)
     
-    # 也包括大写扩展名
-    for ext in [e.upper() for e in SUPPORTED_IMAGE_EXTENSIONS]:
-        image_files.extend(list(Path(image_dir).glob(f'*{ext}')))
-    
-    return [str(p) for p in image_files]
+    return image_files
 
 class ImageEncoder(JsonOperator):
     """
@@ -69,6 +81,8 @@ class ImageEncoder(JsonOperator):
                  max_width: int = 800,
                  max_height: int = 800,
                  quality: int = 85,
+                 resample: int = Image.BILINEAR,
+                 passthrough_max_bytes: int = 150_000,
                  name: str = None,
                  description: str = None):
         """
@@ -80,6 +94,9 @@ class ImageEncoder(JsonOperator):
             max_width: 图片最大宽度，超过会被缩放
             max_height: 图片最大高度，超过会被缩放
             quality: JPEG质量压缩参数（1-100）
+            resample: 缩放使用的重采样滤波器，draft()已将图片缩到目标尺寸的2倍以内，
+                BILINEAR在JPEG压缩后与LANCZOS差异不可见且开销更低
+            passthrough_max_bytes: 小于该字节数且尺寸未超限的RGB/灰度JPEG直接使用原文件，不再重新压缩
             name: 操作符名称
             description: 操作符描述
         """
@@ -92,16 +109,18 @@ class ImageEncoder(JsonOperator):
         self.max_width = max_width
         self.max_height = max_height
         self.quality = quality
+        self.resample = resample
+        self.passthrough_max_bytes = passthrough_max_bytes
     
-    def _compress_image(self, image_path: str) -> bytes:
+    def _compress_image(self, image_path: str) -> str:
         """
-        压缩图片，降低大小
+        压缩图片，降低大小，并编码为base64
         
         Args:
             image_path: 图片路径
             
         Returns:
-            压缩后的图片数据
+            压缩后图片数据的base64字符串
         """
         try:
             # 打开图片
@@ -109,15 +128,23 @@ class ImageEncoder(JsonOperator):
             
             # 检查是否需要调整大小
             width, height = img.size
+            
+            # 已经足够小的JPEG跳过解码和重新编码，直接读取原文件
+            if (img.format == 'JPEG' and img.mode in ('RGB', 'L')
+                    and width <= self.max_width and height <= self.max_height
+                    and os.path.getsize(image_path) < self.passthrough_max_bytes):
+                img.close()
+                logger.debug("图片已足够小，跳过压缩: %dx%d", width, height)
+                with open(image_path, 'rb') as f:
+                    return base64.standard_b64encode(f.read()).decode('ascii')
+            
             if width > self.max_width or height > self.max_height:
-                # 计算缩放比例
-                ratio = min(self.max_width / width, self.max_height / height)
-                new_width = int(width * ratio)
-                new_height = int(height * ratio)
+                # JPEG解码时直接按1/2、1/4、1/8缩小，避免解码全分辨率像素
+                img.draft('RGB', (self.max_width, self.max_height))
                 
-                # 调整大小
-                img = img.resize((new_width, new_height), Image.LANCZOS)
-                print(f"  调整图片大小: {width}x{height} -> {new_width}x{new_height}")
+                # 等比例缩放到最大尺寸以内（原地操作）
+                img.thumbnail((self.max_width, self.max_height), self.resample)
+                logger.debug("调整图片大小: %dx%d -> %dx%d", width, height, img.width, img.height)
             
             # 转换为RGB模式(如果是RGBA或其他模式)
             if img.mode != 'RGB':
@@ -127,15 +154,14 @@ class ImageEncoder(JsonOperator):
             buffer = io.BytesIO()
             img.save(buffer, format='JPEG', quality=self.quality)
             
-            # 获取压缩后的大小
-            compressed_size = buffer.tell()
-            buffer.seek(0)
+            if logger.isEnabledFor(logging.DEBUG):
+                # 获取压缩后的大小和原始文件大小
+                compressed_size = buffer.tell()
+                original_size = os.path.getsize(image_path)
+                logger.debug("压缩图片: %.1fKB -> %.1fKB", original_size / 1024, compressed_size / 1024)
             
-            # 获取原始文件大小
-            original_size = os.path.getsize(image_path)
-            print(f"  压缩图片: {original_size / 1024:.1f}KB -> {compressed_size / 1024:.1f}KB")
-            
-            return buffer.getvalue()
+            # 直接对缓冲区内存编码，避免getvalue()再复制一份JPEG数据
+            return base64.standard_b64encode(buffer.getbuffer()).decode('ascii')
             
         except Exception as e:
             raise RuntimeError(f"压缩图片失败: {str(e)}")
@@ -148,32 +174,29 @@ class ImageEncoder(JsonOperator):
             json_data: 输入的JSON数据
             
         Returns:
-            处理后的JSON数据
+            处理后的JSON数据（原地修改并返回输入数据）
         """
-        result = json_data.copy()
-        
         # 检查输入字段
-        if self.image_path_field not in result:
+        if self.image_path_field not in json_data:
             raise ValueError(f"输入数据中缺少图片路径字段: {self.image_path_field}")
         
-        image_path = result[self.image_path_field]
+        image_path = json_data[self.image_path_field]
         
         # 编码图片
         try:
             # 压缩并编码图片
-            image_data = self._compress_image(image_path)
-            base64_data = base64.b64encode(image_data).decode('utf-8')
-            result[self.base64_output_field] = base64_data
+            base64_data = self._compress_image(image_path)
+            json_data[self.base64_output_field] = base64_data
             
             # 估计token数量（大约每4个字符1个token）
             estimated_tokens = len(base64_data) // 4
-            result["estimated_image_tokens"] = estimated_tokens
-            print(f"  估计图片token数: 约 {estimated_tokens}")
+            json_data["estimated_image_tokens"] = estimated_tokens
+            logger.debug("估计图片token数: 约 %d", estimated_tokens)
             
         except Exception as e:
             raise RuntimeError(f"编码图片失败: {str(e)}")
         
-        return result
+        return json_data
 
 class MessageConstructor(JsonOperator):
     """
@@ -221,6 +244,19 @@ class MessageConstructor(JsonOperator):
         
         只返回JSON内容，不要有其他任何文字。
         """
+        
+        # 消息中只有图片URL随数据变化：预先序列化其余部分，处理时直接拼接base64字符串。
+        # base64字符无需JSON转义，拼接结果与json.dumps整条消息完全一致
+        serialized = json.dumps({
+            "role": "user",
+            "content": [
+                {"type": "text", "text": self.prompt_template},
+                {"type": "image_url", "image_url": {"url": ""}}
+            ]
+        })
+        head, tail = serialized.rsplit('"url": ""', 1)
+        self._message_head = head + '"url": "data:image/jpeg;base64,'
+        self._message_tail = '"' + tail
     
     def process(self, json_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -230,29 +266,18 @@ class MessageConstructor(JsonOperator):
             json_data: 输入的JSON数据
             
         Returns:
-            处理后的JSON数据
+            处理后的JSON数据（原地修改并返回输入数据）
         """
-        result = json_data.copy()
-        
         # 检查输入字段
-        if self.base64_field not in result:
+        if self.base64_field not in json_data:
             raise ValueError(f"输入数据中缺少base64编码字段: {self.base64_field}")
         
-        base64_data = result[self.base64_field]
+        base64_data = json_data[self.base64_field]
         
-        # 构造多模态消息
-        image_message = {
-            "role": "user",
-            "content": [
-                {"type": "text", "text": self.prompt_template},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_data}"}}
-            ]
-        }
+        # 构造并存储序列化后的多模态消息，不对大体积base64字符串做json序列化
+        json_data[self.output_field] = self._message_head + base64_data + self._message_tail
         
-        # 存储消息
-        result[self.output_field] = json.dumps(image_message)
-        
-        return result
+        return json_data
 
 class ResponseParser(JsonOperator):
     """
@@ -290,39 +315,41 @@ class ResponseParser(JsonOperator):
             json_data: 输入的JSON数据
             
         Returns:
-            处理后的JSON数据
+            处理后的JSON数据（原地修改并返回输入数据）
         """
-        result = json_data.copy()
-        result[self.output_field] = []
-        
         # 检查输入字段
-        if self.response_field not in result:
+        if self.response_field not in json_data:
             raise ValueError(f"输入数据中缺少响应字段: {self.response_field}")
         
-        response_text = result[self.response_field]
-        
-        try:
-            # 尝试直接解析为JSON
-            for line in response_text.split("\n"):
-                qa_data = json.loads(line)
-                result[self.output_field].append(qa_data)
-            return result
-        except json.JSONDecodeError:
-            # 如果解析失败，尝试从文本中提取JSON部分
-            json_pattern = r'({.*})'
-            match = re.search(json_pattern, response_text, re.DOTALL)
-            if match:
+        response_text = json_data[self.response_field]
+        qa_items = []
+        
+        # 逐行解析JSON，跳过空行和无法解析的行，只保留问答对象（含JSON数组中的对象）
+        for line in response_text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                parsed = json_loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(parsed, dict):
+                qa_items.append(parsed)
+            elif isinstance(parsed, list):
+                qa_items.extend(qa for qa in parsed if isinstance(qa, dict))
+        
+        if not qa_items:
+            # 如果逐行解析失败，尝试从文本中提取不含嵌套的JSON对象
+            for candidate in _JSON_OBJECT_RE.findall(response_text):
                 try:
-                    qa_data = json.loads(match.group(1))
-                    result[self.output_field] = qa_data
-                    return result
+                    qa_items.append(json_loads(candidate))
                 except json.JSONDecodeError:
                     pass
         
         # 如果所有解析都失败，返回默认值
-        result[self.output_field] = [{"question": "图片中显示了什么?", 
-                                      "answer": "无法解析模型响应"}]
-        return result
+        json_data[self.output_field] = qa_items or [{"question": "图片中显示了什么?", 
+                                                     "answer": "无法解析模型响应"}]
+        return json_data
 
 class SftFormatter(JsonOperator):
     """
@@ -375,12 +402,12 @@ class SftFormatter(JsonOperator):
 
         sft_example = []
         qa_data = json_data[self.qa_field]
-        print(qa_data)
+        logger.debug("问答数据: %s", qa_data)
         image_path = json_data[self.image_path_field]
         image_id = json_data[self.id_field]
         
-        # 获取图片的相对路径
-        relative_path = os.path.basename(image_path)
+        # 获取图片的相对路径，所有问答对共用
+        image_ref = f"images/{os.path.basename(image_path)}"
 
         for qa in qa_data:
             # 构建对话
@@ -399,12 +426,33 @@ class SftFormatter(JsonOperator):
             # 构建SFT示例
             sft_example.append({
                 "id": image_id,
-                "image": f"images/{relative_path}",
+                "image": image_ref,
                 "conversations": conversations
             })
         
         return sft_example
 
+class BufferedJsonSaver(JsonSaver):
+    """
+    带写缓冲的JSON保存器
+    
+    在with块内只打开一次输出文件（追加模式，与JsonSaver逐条写入的行为一致），
+    写入时不逐条flush，由1MB缓冲区合并为少量write系统调用，退出with块时统一落盘。
+    """
+    
+    WRITE_BUFFER_SIZE = 1 << 20
+    
+    def __enter__(self) -> "BufferedJsonSaver":
+        if self.destination is not None:
+            self._file = open(self.destination, 'a', encoding='utf-8', buffering=self.WRITE_BUFFER_SIZE)
+        return self
+    
+    def write_item(self, json_data: Dict[str, Any]) -> None:
+        if self._file is None:
+            super().write_item(json_data)
+            return
+        self._file.write(json.dumps(json_data, ensure_ascii=False) + '\n')
+
 def create_multimodal_pipeline(model_name: str, base_url: str, api_key: str, max_width: int = 800, max_height: int = 800) -> Pipeline:
     """
     创建多模态数据生成pipeline
@@ -477,9 +525,15 @@ def main():
     parser.add_argument("--max-width", type=int, default=800, help="图片最大宽度")
     parser.add_argument("--max-height", type=int, default=800, help="图片最大高度")
     parser.add_argument("--quality", type=int, default=85, help="JPEG压缩质量(1-100)")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发处理的图片数量（同时在途的API请求数）")
+    parser.add_argument("--verbose", "-v", action="store_true", help="显示每张图片的压缩和解析详情")
     
     args = parser.parse_args()
     
+    if args.verbose:
+        logging.basicConfig(format="  %(message)s")
+        logger.setLevel(logging.DEBUG)
+    
     # 验证API密钥
     if not args.api_key:
         print("错误: 未提供API密钥。请通过--api-key参数提供API密钥。")
@@ -507,33 +561,33 @@ def main():
         max_height=args.max_height
     )
     
-    # 初始化JsonSaver
-    saver = JsonSaver(args.output)
-    
-    # 处理每个图片
-    for i, image_path in enumerate(image_files):
-        print(f"处理图片 {i+1}/{len(image_files)}: {image_path}")
+    # 初始化JsonSaver，输出文件在整个处理过程中只打开一次
+    # 并发处理图片：耗时主要在等待模型API响应，线程可以重叠多个在途请求
+    with BufferedJsonSaver(args.output) as saver, \
+            ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        future_to_path = {
+            executor.submit(pipeline.process, {"id": i, "image_path": image_path}): image_path
+            for i, image_path in enumerate(image_files)
+        }
         
-        try:
-            # 准备输入数据
-            input_data = {
-                "id": i,
-                "image_path": image_path
-            }
+        # 结果只在主线程中写入，无需对saver加锁
+        for done, future in enumerate(as_completed(future_to_path), 1):
+            # 取出已完成的future，写入后即可释放其结果，内存不随图片数量增长
+            image_path = future_to_path.pop(future)
+            print(f"处理图片 {done}/{len(image_files)}: {image_path}")
             
-            # 使用pipeline处理数据
-            result = pipeline.process(input_data)
+            try:
+                result = future.result()
 
-            # 保存结果
-            for item in result:
-                saver.write(item)
-            
-            if "conversations" in result and len(result["conversations"]) > 0:
-                question = result["conversations"][0]["value"].replace("<image>\n", "")
-                print(f"  成功生成问答对: {question[:50]}...")
-            
-        except Exception as e:
-            print(f"  处理图片时出错: {e}")
+                # 保存结果
+                saver.write(result)
+                
+                if "conversations" in result and len(result["conversations"]) > 0:
+                    question = result["conversations"][0]["value"].replace("<image>\n", "")
+                    print(f"  成功生成问答对: {question[:50]}...")
+                
+            except Exception as e:
+                print(f"  处理图片时出错: {e}")
     
     print(f"完成! 生成的数据已保存到 {args.output}")
     return 0
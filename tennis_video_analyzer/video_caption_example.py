@@ -11,19 +11,45 @@ VideoCaptioningInvoker接收包含视频路径的JSON输入，提取关键帧，
 import os
 import cv2
 import base64
-import tempfile
 import argparse
 import numpy as np
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, Optional, List
 from jsonflow.operators.model import ModelInvoker
 from jsonflow.core import Pipeline
 from jsonflow.io import JsonLoader, JsonSaver
 
+try:
+    # PyAV为可选依赖，仅在启用硬件解码时使用
+    import av
+except ImportError:
+    av = None
+
+# 设置JSONFLOW_HWACCEL=1启用PyAV硬件解码，JSONFLOW_HWACCEL_DEVICE指定设备类型（如cuda、videotoolbox、vaapi）
+HWACCEL_ENABLED = os.environ.get("JSONFLOW_HWACCEL") == "1"
+HWACCEL_DEVICE = os.environ.get("JSONFLOW_HWACCEL_DEVICE", "cuda")
+
+try:
+    # pybase64使用SIMD指令实现base64编码，速度接近内存拷贝
+    from pybase64 import b64encode_as_string
+except ImportError:
+    def b64encode_as_string(data: bytes) -> str:
+        return base64.b64encode(data).decode('ascii')
+
+_IMG_PREFIX = "data:image/jpeg;base64,"
+
 
 class VideoCaptioningInvoker(ModelInvoker):
     """视频帧标注操作符"""
     
+    # 采样帧数与总帧数之比低于该值（约一个GOP一帧）时改为逐帧定位读取
+    SEQUENTIAL_DECODE_MIN_DENSITY = 1 / 250
+    
+    # 模型会把输入帧缩放到较低分辨率，质量75已足够；OPTIMIZE按图像内容生成霍夫曼表，进一步减小体积
+    JPEG_ENCODE_PARAMS = [int(cv2.IMWRITE_JPEG_QUALITY), 75, int(cv2.IMWRITE_JPEG_OPTIMIZE), 1]
+    
+    _DEFAULT_SYSTEM_MSG = {"role": "system", "content": "使用中文生成回复"}
+    
     def __init__(self, 
                  model: str,
                  video_field: str = "video_path",
@@ -31,6 +57,8 @@ class VideoCaptioningInvoker(ModelInvoker):
                  captions_field: str = "captions",
                  caption_prompt: str = "请简要描述这个视频帧的内容。",
                  num_frames: int = 5,
+                 image_resolution: Optional[int] = 672,
+                 copy_on_write: bool = False,
                  **kwargs):
         """
         初始化视频帧标注操作符
@@ -38,10 +66,12 @@ class VideoCaptioningInvoker(ModelInvoker):
         Args:
             model: 模型名称（需要支持图像处理，如qianfan-llama-vl-8b）
             video_field: 输入视频路径的字段名，默认为"video_path"
-            frames_field: 输出帧信息的字段名，默认为"frames"
+            frames_field: 输出提取帧数量的字段名，默认为"frames"
             captions_field: 输出标注的字段名，默认为"captions"
             caption_prompt: 向模型发送的提示文本，默认为简单的描述请求
             num_frames: 要从视频中提取的帧数量
+            image_resolution: 帧的最长边上限（像素），超过时等比缩小后再编码，None或0表示不缩放
+            copy_on_write: 是否复制输入数据后再修改，默认为False（原地修改）
             **kwargs: 其他传递给ModelInvoker的参数
         """
         super().__init__(model=model, **kwargs)
@@ -50,6 +80,8 @@ class VideoCaptioningInvoker(ModelInvoker):
         self.captions_field = captions_field
         self.caption_prompt = caption_prompt
         self.num_frames = num_frames
+        self.image_resolution = image_resolution
+        self.copy_on_write = copy_on_write
     
     def process(self, json_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -59,44 +91,30 @@ class VideoCaptioningInvoker(ModelInvoker):
             json_data: 包含视频路径的JSON数据
             
         Returns:
-            dict: 添加了帧和标注的JSON数据
+            dict: 添加了帧和标注的JSON数据（copy_on_write为False时原地修改并返回输入数据）
         """
         if not json_data or self.video_field not in json_data:
             return json_data
             
-        result = json_data.copy()
+        result = json_data.copy() if self.copy_on_write else json_data
         video_path = result[self.video_field]
         
-        # 提取视频帧
+        # 提取视频帧（base64编码的JPEG数据）
         try:
             frames = self._extract_frames(video_path, self.num_frames)
-            result[self.frames_field] = frames
+            result[self.frames_field] = len(frames)
         except Exception as e:
             result[self.captions_field] = [f"视频帧提取错误: {str(e)}"]
             return result
         
-        # 为每个帧生成标注
-        content = []
-        for frame in frames:
-            # 读取并编码图像
-            try:
-                with open(frame, "rb") as image_file:
-                    base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-                    if base64_image:
-                        image_content = {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-
-                        content.append(image_content)
-            except Exception as e:
-                print(e)
-                continue
+        # 为每个帧构建图像内容
+        content = [
+            {"type": "image_url", "image_url": {"url": _IMG_PREFIX + base64_image}}
+            for base64_image in frames
+        ]
         content.append({"type": "text", "text": self.caption_prompt})
         # 构建包含图像的消息
-        messages = [{"role": "system", "content": "使用中文生成回复"}, {"role": "user", "content": content}]
+        messages = [self._DEFAULT_SYSTEM_MSG, {"role": "user", "content": content}]
         # 调用支持图像的模型
         try:
             response = self.call_llm(messages)
@@ -106,8 +124,13 @@ class VideoCaptioningInvoker(ModelInvoker):
 
         return result
     
-    def _extract_frames(self, video_path, num_frames: int) -> List[Dict[str, Any]]:
-        """从视频中提取帧，使用OpenCV"""
+    def _extract_frames(self, video_path, num_frames: int) -> List[str]:
+        """
+        从视频中提取帧，使用OpenCV在内存中编码为JPEG，返回base64编码的JPEG数据列表
+        
+        解码与编码重叠进行：每解码出一帧就提交到线程池编码，
+        OpenCV的JPEG编码会释放GIL，编码线程与解码循环真正并行。
+        """
         print(f"正在从视频中提取帧: {video_path}")
         
         
@@ -123,41 +146,124 @@ class VideoCaptioningInvoker(ModelInvoker):
         
         print(f"视频总帧数: {total_frames}")
         
-        # 创建临时目录存储图像
-        temp_dir = tempfile.mkdtemp()
-        temp_image_paths = []
-        
         # 均匀抽取帧
         if total_frames < num_frames:
             # 如果视频帧数少于指定帧数，则全部使用
             indices = list(range(total_frames))
+        elif num_frames == 1:
+            # 只取一帧时使用中间帧
+            indices = [total_frames // 2]
         else:
-            # 均匀抽取指定数量的帧
-            indices = np.linspace(0, total_frames-1, num=num_frames, dtype=int)
-        
-        # 提取并保存帧
-        for i, frame_idx in enumerate(indices):
-            # 设置读取位置
-            video.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-            success, frame = video.read()
+            # 均匀抽取指定数量的帧，整数运算避免浮点误差导致的取整偏差
+            indices = ((np.arange(num_frames, dtype=np.int64) * (total_frames - 1)) // (num_frames - 1)).tolist()
+        
+        encoded_frames = []
+        with ThreadPoolExecutor(max_workers=max(1, min(len(indices), os.cpu_count() or 1))) as executor:
+            def submit_all(frame_iter):
+                return [(frame_idx, executor.submit(self._encode_frame, frame)) for frame_idx, frame in frame_iter]
+            
+            # 提取帧，启用硬件解码时优先使用PyAV，失败则回退到OpenCV软件解码
+            pending = None
+            if HWACCEL_ENABLED and av is not None:
+                try:
+                    pending = submit_all(self._read_frames_pyav(video_path, indices))
+                except Exception as e:
+                    print(f"硬件解码失败，回退到OpenCV: {e}")
+            if pending is None:
+                pending = submit_all(self._read_frames(video, indices, total_frames))
+            
+            # 释放视频资源
+            video.release()
             
-            if success:
-                # OpenCV以BGR格式读取，需要转换为RGB
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                img = Image.fromarray(frame_rgb)
-                
-                # 保存为JPEG文件
-                temp_image_path = os.path.join(temp_dir, f"frame_{i+1}.jpg")
-                img.save(temp_image_path, "JPEG", quality=90)
-                temp_image_paths.append(temp_image_path)
-            else:
+            # 按帧顺序收集编码结果
+            for frame_idx, future in pending:
+                base64_image = future.result()
+                if base64_image:
+                    encoded_frames.append(base64_image)
+                else:
+                    print(f"帧 {frame_idx} 编码失败")
+        
+        print(f"已提取 {len(encoded_frames)} 帧")
+        return encoded_frames
+    
+    def _encode_frame(self, frame) -> Optional[str]:
+        """将BGR帧编码为JPEG并转为base64字符串，失败时返回None"""
+        # 模型的图像token数随分辨率增长，先等比缩小到最长边不超过image_resolution
+        height, width = frame.shape[:2]
+        if self.image_resolution and max(height, width) > self.image_resolution:
+            scale = self.image_resolution / max(height, width)
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        
+        # imencode直接接受BGR数据，无需颜色转换，也不经过临时文件
+        ok, buffer = cv2.imencode('.jpg', frame, self.JPEG_ENCODE_PARAMS)
+        return b64encode_as_string(buffer.tobytes()) if ok else None
+    
+    def _read_frames(self, video, indices, total_frames: int):
+        """
+        按帧索引读取视频帧，逐个返回(帧索引, BGR帧)
+        
+        H.264/H.265等编码每次定位都要回到上一个关键帧重新解码，
+        因此采样较密时顺序解码一遍并只取目标帧；采样非常稀疏时才逐帧定位。
+        """
+        if len(indices) < total_frames * self.SEQUENTIAL_DECODE_MIN_DENSITY:
+            for frame_idx in indices:
+                # 设置读取位置
+                video.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+                success, frame = video.read()
+                if success:
+                    yield frame_idx, frame
+                else:
+                    print(f"帧 {frame_idx} 读取失败")
+            return
+        
+        # 用字节位图标记目标帧，循环中按下标判断，比集合查找更轻量
+        last_idx = max(indices)
+        keep = bytearray(last_idx + 1)
+        for frame_idx in indices:
+            keep[frame_idx] = 1
+        for frame_idx in range(last_idx + 1):
+            # grab只解码不取出，非目标帧不做像素转换
+            if not video.grab():
                 print(f"帧 {frame_idx} 读取失败")
+                return
+            if keep[frame_idx]:
+                success, frame = video.retrieve()
+                if success:
+                    yield frame_idx, frame
+                else:
+                    print(f"帧 {frame_idx} 读取失败")
+
+    
+    def _read_frames_pyav(self, video_path, indices):
+        """
+        使用PyAV硬件解码读取视频帧，逐个返回(帧索引, BGR帧)
         
-        # 释放视频资源
-        video.release()
+        只有目标帧会从解码器表面转换为numpy数组。
+        """
+        if not indices:
+            return
+        last_idx = max(indices)
+        keep = bytearray(last_idx + 1)
+        for frame_idx in indices:
+            keep[frame_idx] = 1
         
-        print(f"已提取 {len(temp_image_paths)} 帧")
-        return temp_image_paths
+        open_kwargs = {}
+        try:
+            from av.codec.hwaccel import HWAccel
+            open_kwargs["hwaccel"] = HWAccel(device_type=HWACCEL_DEVICE, allow_software_fallback=True)
+        except ImportError:
+            # 旧版PyAV不支持硬件解码，使用多线程软件解码
+            pass
+        
+        with av.open(video_path, **open_kwargs) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"
+            for frame_idx, frame in enumerate(container.decode(stream)):
+                if keep[frame_idx]:
+                    yield frame_idx, frame.to_ndarray(format="bgr24")
+                if frame_idx >= last_idx:
+                    break
 
 
 def main():
@@ -173,6 +279,9 @@ def main():
     parser = argparse.ArgumentParser(description="视频帧标注示例")
     parser.add_argument("--video", required=True, help="输入视频的路径")
     parser.add_argument("--frames", type=int, default=4, help="要提取的帧数量")
+    parser.add_argument("--image-resolution", type=int, default=672,
+                        help="帧的最长边上限（像素），超过时等比缩小，设为0则不缩放")
+    parser.add_argument("--context-length", type=int, default=32768, help="模型的上下文长度（token数），用于估算图像token预算")
     parser.add_argument("--output", default="video_captions.jsonl", help="输出文件路径")
     parser.add_argument("--model", default="qianfan-llama-vl-8b", help="使用的模型名称")
     parser.add_argument("--base-url", default="https://qianfan.baidubce.com/v2", help="API基础URL")
@@ -185,7 +294,16 @@ def main():
     args = parser.parse_args()
     
     # 创建输出目录
-    os.makedirs(os.path.dirname(os.path.abspath(args.output)) if os.path.dirname(args.output) else ".", exist_ok=True)
+    output_dir = os.path.dirname(args.output)
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+    
+    # 估算图像token数（约每14x14像素一个token），超过上下文长度时提示
+    if args.image_resolution:
+        expected_image_tokens = args.frames * (args.image_resolution // 14) ** 2
+        if expected_image_tokens > args.context_length:
+            print(f"警告: 预计图像token数约 {expected_image_tokens}，超过模型上下文长度 {args.context_length}，"
+                  f"请减少--frames或降低--image-resolution")
     
     # 检查视频文件
     if not os.path.exists(args.video):
@@ -211,7 +329,8 @@ def main():
             caption_prompt=args.caption_prompt,
             system_prompt=args.system_prompt,
             max_tokens=300,
-            num_frames=args.frames
+            num_frames=args.frames,
+            image_resolution=args.image_resolution
         )
     ])
     
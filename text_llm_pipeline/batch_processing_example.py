@@ -10,12 +10,14 @@
 import os
 import json
 import argparse
-from typing import Dict, Any, List
+import concurrent.futures
+from typing import Dict, Any, List, Iterator
 from jsonflow.core import Pipeline, MultiThreadExecutor
 from jsonflow.io import JsonLoader, JsonSaver
 
 # 导入自定义操作符
-from text_llm_example import TextProcessor, TextLLMProcessor, ResponseSummarizer
+from text_llm_example import TextProcessor, DedupLLMProcessor, ResponseSummarizer
+from io_utils import ensure_parent_dir
 
 
 def load_sample_data() -> List[Dict[str, Any]]:
@@ -54,12 +56,45 @@ def load_sample_data() -> List[Dict[str, Any]]:
     ]
 
 
+class StreamingThreadExecutor(MultiThreadExecutor):
+    """
+    流式多线程执行器
+    
+    与MultiThreadExecutor相同地并发执行Pipeline，但每条数据处理完成后立即返回结果，
+    调用方可以边处理边保存，无需在内存中保留全部结果。
+    """
+    
+    def execute_iter(self, json_data_list: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        并发执行Pipeline，按完成顺序逐条返回结果
+        
+        Args:
+            json_data_list: 输入的JSON数据列表
+            
+        Yields:
+            dict: 处理后的JSON数据，处理失败时为包含error字段的数据
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            future_to_index = {
+                executor.submit(self.execute, data): i
+                for i, data in enumerate(json_data_list)
+            }
+            for future in concurrent.futures.as_completed(future_to_index):
+                # 取出已完成的future，结果交给调用方后即可释放，内存不随数据量增长
+                index = future_to_index.pop(future)
+                try:
+                    yield future.result()
+                except Exception as e:
+                    print(f"Error processing item at index {index}: {e}")
+                    yield {"error": str(e)}
+
+
 def main():
     """
     运行文本语言模型批量处理示例。
     
     这个函数:
-    1. 创建一个Pipeline包含TextProcessor和TextLLMProcessor
+    1. 创建一个Pipeline包含TextProcessor和DedupLLMProcessor
     2. 使用MultiThreadExecutor并行处理多个输入
     3. 保存处理结果
     """
@@ -71,13 +106,12 @@ def main():
     parser.add_argument("--base-url", default="https://qianfan.baidubce.com/v2", help="API基础URL")
     parser.add_argument("--api-key", required=True, help="API密钥")
     parser.add_argument("--system-prompt", default="你是一个知识渊博、乐于助人的AI助手。", help="系统提示")
-    parser.add_argument("--threads", type=int, default=2, help="并行处理的线程数")
+    parser.add_argument("--threads", type=int, default=32, help="并行处理的线程数（模型调用主要在等待API响应，可以设置较高）")
+    parser.add_argument("--qps", type=float, default=None, help="每秒最多发起的模型调用次数，用于遵守API限流，不指定则不限制")
     args = parser.parse_args()
     
     # 创建输出目录
-    output_dir = os.path.dirname(os.path.abspath(args.output))
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
+    ensure_parent_dir(args.output)
     
     # 加载输入数据
     input_data = []
@@ -97,16 +131,21 @@ def main():
             input_field="input_text",
             output_field="processed_text",
             add_instruction=True,
-            instruction="请详细回答以下问题："
+            instruction="请详细回答以下问题：",
+            # 第一个操作符复制输入数据，后续操作符原地修改这份副本，
+            # input_data中的原始数据不会累积模型回复
+            copy_on_write=True
         ),
-        TextLLMProcessor(
+        # 数据集中常有重复问题，相同问题只调用一次模型
+        DedupLLMProcessor(
             model=args.model,
             base_url=args.base_url,
             api_key=args.api_key,
             input_field="processed_text",
             output_field="model_response",
             system_prompt=args.system_prompt,
-            max_tokens=800
+            max_tokens=800,
+            qps=args.qps
         ),
         ResponseSummarizer(
             input_field="model_response",
@@ -116,28 +155,30 @@ def main():
     ])
     
     # 创建多线程执行器
-    executor = MultiThreadExecutor(pipeline, max_workers=args.threads)
+    executor = StreamingThreadExecutor(pipeline, max_workers=args.threads)
     
     # 批量处理
     print(f"\n=== JSONFlow 文本语言模型批量处理示例 (线程数: {args.threads}) ===")
     print(f"开始处理 {len(input_data)} 条输入...")
     
     try:
-        results = executor.execute_all(input_data)
-        print(f"✓ 批量处理完成，共处理 {len(results)} 条数据")
-        
-        # 显示结果摘要
+        # 每条结果完成后立即写入并刷新到文件，中途失败也能保留已完成的结果
+        num_results = 0
         print("\n=== 处理结果摘要 ===")
-        for i, result in enumerate(results[:3], 1):  # 只显示前3条
-            print(f"{i}. 问题: {result.get('input_text', '')[:30]}...")
-            print(f"   摘要: {result.get('summary', '无摘要')[:50]}...\n")
+        with JsonSaver(args.output) as saver:
+            for result in executor.execute_iter(input_data):
+                saver.write(result)
+                num_results += 1
+                
+                # 只显示前3条
+                if num_results <= 3:
+                    print(f"{num_results}. 问题: {result.get('input_text', '')[:30]}...")
+                    print(f"   摘要: {result.get('summary', '无摘要')[:50]}...\n")
         
-        if len(results) > 3:
-            print(f"... 共 {len(results)} 条结果")
+        if num_results > 3:
+            print(f"... 共 {num_results} 条结果")
         
-        # 保存结果
-        saver = JsonSaver(args.output)
-        saver.write_all(results)
+        print(f"✓ 批量处理完成，共处理 {num_results} 条数据")
         print(f"\n结果已保存到 {args.output}")
         
     except Exception as e:
@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+文本语言模型示例共用的文件工具函数
+"""
+
+import os
+
+
+def ensure_parent_dir(path: str) -> None:
+    """
+    确保文件所在目录存在
+
+    路径不含目录部分（当前目录）或目录已存在时不做任何操作。
+
+    Args:
+        path: 文件路径
+    """
+    output_dir = os.path.dirname(path)
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
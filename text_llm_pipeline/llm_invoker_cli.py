@@ -15,6 +15,13 @@ from typing import Dict, Any, List, Optional
 from jsonflow.operators.model import ModelInvoker
 from jsonflow.core import Pipeline
 from jsonflow.io import JsonSaver
+from io_utils import ensure_parent_dir
+
+try:
+    # 优先使用libyaml的C实现解析配置
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
 
 
 class ConfigurableModelInvoker(ModelInvoker):
@@ -37,6 +44,11 @@ class ConfigurableModelInvoker(ModelInvoker):
         super().__init__(model=model, **kwargs)
         self.prompt_template = prompt_template
         self.system_prompt = system_prompt
+        # 系统消息对每次调用都相同，预先构建
+        self._system_msg = ({"role": "system", "content": system_prompt},) if system_prompt else ()
+        # 预先按占位符切分模板，调用时只需拼接
+        self._prompt_parts = prompt_template.split("{input}")
+        self._has_placeholder = len(self._prompt_parts) > 1
     
     def call_with_text(self, input_text: str) -> str:
         """
@@ -49,18 +61,13 @@ class ConfigurableModelInvoker(ModelInvoker):
             str: 模型回复
         """
         # 填充提示模板
-        prompt = self.prompt_template
-        if "{input}" in prompt:
-            prompt = prompt.replace("{input}", input_text)
+        if self._has_placeholder:
+            prompt = input_text.join(self._prompt_parts)
         else:
-            prompt = f"{prompt}\n{input_text}"
+            prompt = f"{self.prompt_template}\n{input_text}"
         
         # 构建消息
-        messages = []
-        if self.system_prompt:
-            messages.append({"role": "system", "content": self.system_prompt})
-        
-        messages.append({"role": "user", "content": prompt})
+        messages = [*self._system_msg, {"role": "user", "content": prompt}]
         
         # 调用语言模型
         try:
@@ -86,7 +93,7 @@ def load_config(config_path: str) -> Dict[str, Any]:
         
     try:
         with open(config_path, 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
+            config = yaml.load(f, Loader=YamlLoader)
         return config
     except Exception as e:
         print(f"错误: 加载配置文件失败: {str(e)}")
@@ -188,10 +195,8 @@ def main():
     if args.output:
         # 保存到文件
         try:
-            output_dir = os.path.dirname(os.path.abspath(args.output))
-            if output_dir:
-                os.makedirs(output_dir, exist_ok=True)
-                
+            ensure_parent_dir(args.output)
+            
             with open(args.output, 'w', encoding='utf-8') as f:
                 f.write(result)
             print(f"结果已保存到: {args.output}")
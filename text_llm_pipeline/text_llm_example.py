@@ -9,11 +9,16 @@ TextLLMProcessor接收包含文本的JSON输入，
 """
 
 import os
+import time
+import hashlib
 import argparse
+import threading
+from concurrent.futures import Future
 from typing import Dict, Any, Optional, List
 from jsonflow.operators.model import ModelInvoker
 from jsonflow.core import Pipeline, JsonOperator
 from jsonflow.io import JsonLoader, JsonSaver
+from io_utils import ensure_parent_dir
 
 
 class TextProcessor(JsonOperator):
@@ -23,7 +28,8 @@ class TextProcessor(JsonOperator):
                  input_field: str = "input_text",
                  output_field: str = "processed_text",
                  add_instruction: bool = True,
-                 instruction: str = "请回答以下问题："):
+                 instruction: str = "请回答以下问题：",
+                 copy_on_write: bool = False):
         """
         初始化文本预处理操作符
         
@@ -32,12 +38,16 @@ class TextProcessor(JsonOperator):
             output_field: 输出处理后文本的字段名，默认为"processed_text"
             add_instruction: 是否添加指令，默认为True
             instruction: 添加的指令文本，默认为"请回答以下问题："
+            copy_on_write: 是否复制输入数据后再修改，默认为False（原地修改）
         """
         super().__init__(name="TextProcessor", description="Text preprocessing operator")
         self.input_field = input_field
         self.output_field = output_field
         self.add_instruction = add_instruction
         self.instruction = instruction
+        self.copy_on_write = copy_on_write
+        # 指令前缀对每条数据都相同，预先拼接
+        self._prefix = f"{instruction}\n" if add_instruction else ""
     
     def process(self, json_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -47,20 +57,20 @@ class TextProcessor(JsonOperator):
             json_data: 包含文本的JSON数据
             
         Returns:
-            dict: 添加了处理后文本的JSON数据
+            dict: 添加了处理后文本的JSON数据（copy_on_write为False时原地修改并返回输入数据）
         """
         if not json_data or self.input_field not in json_data:
             return json_data
             
-        result = json_data.copy()
+        result = json_data.copy() if self.copy_on_write else json_data
         input_text = result[self.input_field]
         
         # 文本处理逻辑
         processed_text = input_text.strip()
         
         # 添加指令（如果需要）
-        if self.add_instruction and processed_text:
-            processed_text = f"{self.instruction}\n{processed_text}"
+        if self._prefix and processed_text:
+            processed_text = self._prefix + processed_text
         
         result[self.output_field] = processed_text
         return result
@@ -74,6 +84,8 @@ class TextLLMProcessor(ModelInvoker):
                  input_field: str = "processed_text",
                  output_field: str = "model_response",
                  system_prompt: Optional[str] = None,
+                 qps: Optional[float] = None,
+                 copy_on_write: bool = False,
                  **kwargs):
         """
         初始化文本语言模型处理操作符
@@ -83,12 +95,52 @@ class TextLLMProcessor(ModelInvoker):
             input_field: 输入文本的字段名，默认为"processed_text"
             output_field: 输出模型回复的字段名，默认为"model_response"
             system_prompt: 系统提示，默认为None
+            qps: 每秒最多发起的模型调用次数，默认为None（不限制）
+            copy_on_write: 是否复制输入数据后再修改，默认为False（原地修改）
             **kwargs: 其他传递给ModelInvoker的参数
         """
         super().__init__(model=model, **kwargs)
         self.input_field = input_field
         self.output_field = output_field
         self.system_prompt = system_prompt
+        # 系统消息对每次调用都相同，预先构建
+        self._system_msg = ({"role": "system", "content": system_prompt},) if system_prompt else ()
+        self.qps = qps
+        self.copy_on_write = copy_on_write
+        self._rate_lock = threading.Lock()
+        self._next_call_time = 0.0
+    
+    def _wait_for_rate_limit(self) -> None:
+        """
+        按qps限制模型调用频率
+        
+        多线程执行器共享同一个操作符实例，因此在锁内为每次调用预约发送时间，
+        锁外等待，避免持锁睡眠。
+        """
+        if not self.qps:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            call_time = max(now, self._next_call_time)
+            self._next_call_time = call_time + 1.0 / self.qps
+        if call_time > now:
+            time.sleep(call_time - now)
+    
+    def _generate(self, input_text: str) -> str:
+        """
+        调用语言模型生成回复，失败时抛出异常
+        
+        Args:
+            input_text: 用户输入文本
+            
+        Returns:
+            str: 模型回复
+        """
+        # 构建消息
+        messages = [*self._system_msg, {"role": "user", "content": input_text}]
+        
+        self._wait_for_rate_limit()
+        return self.call_llm(messages)
     
     def process(self, json_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -98,38 +150,87 @@ class TextLLMProcessor(ModelInvoker):
             json_data: 包含文本的JSON数据
             
         Returns:
-            dict: 添加了模型回复的JSON数据
+            dict: 添加了模型回复的JSON数据（copy_on_write为False时原地修改并返回输入数据）
         """
         if not json_data or self.input_field not in json_data:
             return json_data
             
-        result = json_data.copy()
+        result = json_data.copy() if self.copy_on_write else json_data
         input_text = result[self.input_field]
         
-        # 构建消息
-        messages = []
-        if self.system_prompt:
-            messages.append({"role": "system", "content": self.system_prompt})
-        
-        messages.append({"role": "user", "content": input_text})
-        
         # 调用语言模型
         try:
-            response = self.call_llm(messages)
-            result[self.output_field] = response
+            result[self.output_field] = self._generate(input_text)
         except Exception as e:
             result[self.output_field] = f"模型调用错误: {str(e)}"
         
         return result
 
 
+class DedupLLMProcessor(TextLLMProcessor):
+    """
+    去重的文本语言模型处理操作符
+    
+    相同输入文本只调用一次模型，其余记录复用同一回复。并发到达的重复输入
+    等待同一个进行中的调用，而不是各自发起请求。调用失败的结果不缓存，后续重复输入会重试。
+    """
+    
+    def __init__(self, model: str, **kwargs):
+        """
+        初始化去重的文本语言模型处理操作符
+        
+        Args:
+            model: 模型名称
+            **kwargs: 其他传递给TextLLMProcessor的参数
+        """
+        super().__init__(model=model, **kwargs)
+        self._cache: Dict[bytes, Future] = {}
+        self._cache_lock = threading.Lock()
+    
+    def _generate(self, input_text: str) -> str:
+        """
+        按输入文本去重后调用语言模型
+        
+        Args:
+            input_text: 用户输入文本
+            
+        Returns:
+            str: 模型回复
+        """
+        # 128位blake2b摘要作为缓存键，不必在内存中保留完整输入文本
+        key = hashlib.blake2b(input_text.encode("utf-8"), digest_size=16).digest()
+        with self._cache_lock:
+            future = self._cache.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._cache[key] = future
+        
+        if not is_owner:
+            return future.result()
+        
+        try:
+            response = super()._generate(input_text)
+        except BaseException as e:
+            # 任何异常（包括KeyboardInterrupt等）都要移除缓存并结束future，否则等待中的重复请求会永久阻塞；
+            # 非Exception异常只在当前线程抛出，等待者收到RuntimeError
+            with self._cache_lock:
+                del self._cache[key]
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError(f"重复请求的模型调用被中断: {e!r}"))
+            raise
+        future.set_result(response)
+        return response
+
+
 class ResponseSummarizer(JsonOperator):
     """回复总结操作符"""
     
     def __init__(self, 
                  input_field: str = "model_response",
                  output_field: str = "summary",
-                 max_length: int = 100):
+                 max_length: int = 100,
+                 drop_full_response: bool = False,
+                 copy_on_write: bool = False):
         """
         初始化回复总结操作符
         
@@ -137,11 +238,15 @@ class ResponseSummarizer(JsonOperator):
             input_field: 输入模型回复的字段名，默认为"model_response"
             output_field: 输出总结的字段名，默认为"summary"
             max_length: 总结的最大长度，默认为100
+            drop_full_response: 是否在生成总结后删除完整回复字段，默认为False
+            copy_on_write: 是否复制输入数据后再修改，默认为False（原地修改）
         """
         super().__init__(name="ResponseSummarizer", description="Response summarization operator")
         self.input_field = input_field
         self.output_field = output_field
         self.max_length = max_length
+        self.drop_full_response = drop_full_response
+        self.copy_on_write = copy_on_write
     
     def process(self, json_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -151,21 +256,23 @@ class ResponseSummarizer(JsonOperator):
             json_data: 包含模型回复的JSON数据
             
         Returns:
-            dict: 添加了总结的JSON数据
+            dict: 添加了总结的JSON数据（copy_on_write为False时原地修改并返回输入数据）
         """
         if not json_data or self.input_field not in json_data:
             return json_data
             
-        result = json_data.copy()
-        response = result[self.input_field]
-        
-        # 简单的总结逻辑：截取前max_length个字符
-        if len(response) > self.max_length:
-            summary = response[:self.max_length] + "..."
+        result = json_data.copy() if self.copy_on_write else json_data
+        if self.drop_full_response:
+            # 只保留总结时移除完整回复，后续操作符和保存时无需再处理长文本
+            response = result.pop(self.input_field)
         else:
-            summary = response
+            response = result[self.input_field]
         
-        result[self.output_field] = summary
+        # 简单的总结逻辑：截取前max_length个字符，回复较短时直接复用原字符串
+        if len(response) <= self.max_length:
+            result[self.output_field] = response
+        else:
+            result[self.output_field] = response[:self.max_length] + "..."
         return result
 
 
@@ -189,9 +296,7 @@ def main():
     args = parser.parse_args()
     
     # 创建输出目录
-    output_dir = os.path.dirname(os.path.abspath(args.output))
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
+    ensure_parent_dir(args.output)
     
     # 创建示例数据
     input_text = args.input if args.input else "人工智能的发展历程是怎样的？请简要概述其主要阶段和里程碑。"